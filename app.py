@@ -1,21 +1,174 @@
 import streamlit as st
-import requests
+import httpx
 import pandas as pd
+import numpy as np
 import time
+import io
+import uuid
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 
 # --- CONFIGURATION ---
 API_URL = "http://127.0.0.1:8000"
+BULK_CHUNK_SIZE = 32  # texts per /predict/bulk request
+BULK_WORKERS = 8      # concurrent /predict/bulk requests
+EXPORT_TOP_N = 3      # labels per row in the CSV export
+HISTORY_FETCH = 20    # newest records pulled per history refresh
+HISTORY_KEEP = 200    # records kept client-side across refreshes
+LABELS_TTL = 30       # seconds a session reuses its label list before refetching
+LABELS_TIMEOUT = httpx.Timeout(2.0, connect=0.5)  # fail fast so an outage doesn't stall renders
 st.set_page_config(page_title="Zero-Shot ML Dashboard", layout="wide")
 
 # --- HELPER FUNCTIONS ---
-def get_global_labels():
+@st.cache_resource
+def get_http_client():
+    """One pooled keep-alive client for the backend, shared across reruns and sessions"""
+    transport = httpx.HTTPTransport(
+        # HTTP/2 is only negotiated (via ALPN) on TLS backends; plain http:// stays on 1.1
+        http2=API_URL.startswith("https://"),
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=16),
+        retries=2,
+    )
+    return httpx.Client(base_url=API_URL, transport=transport, timeout=httpx.Timeout(60.0, connect=5.0))
+
+CLIENT = get_http_client()
+
+@st.cache_data(ttl=10, show_spinner=False)
+def get_bootstrap(limit=HISTORY_FETCH):
+    """Labels + recent history in a single request, memoized across reruns"""
+    response = CLIENT.get("/bootstrap", params={"limit": limit}, timeout=LABELS_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+def get_labels_full():
+    """Raw label records; falls back to the last good copy when the backend is slow or down"""
+    cached = st.session_state.get("_labels_cache")
+    if cached and time.time() - cached[0] < LABELS_TTL:
+        return cached[1]
     try:
-        response = requests.get(f"{API_URL}/labels")
-        if response.status_code == 200:
-            return [item['label'] for item in response.json()]
-        return []
-    except:
-        return []
+        labels = get_bootstrap()["labels"]
+    except httpx.HTTPError:
+        labels = cached[1] if cached else []
+    st.session_state["_labels_cache"] = (time.time(), labels)
+    return labels
+
+def get_global_labels():
+    return [item['label'] for item in get_labels_full()]
+
+def post_bulk_chunk(chunk):
+    """Classify one shard of a bulk upload"""
+    res = CLIENT.post(
+        "/predict/bulk/json",
+        content=orjson.dumps(chunk),
+        headers={"Content-Type": "application/json"},
+    )
+    res.raise_for_status()
+    return res.json()['results']
+
+def predict_bulk(items):
+    """Fan shards out concurrently; results keep the order of the input"""
+    chunks = [items[i:i + BULK_CHUNK_SIZE] for i in range(0, len(items), BULK_CHUNK_SIZE)]
+    with ThreadPoolExecutor(max_workers=BULK_WORKERS) as ex:
+        shard_results = list(ex.map(post_bulk_chunk, chunks))
+    return [row for shard in shard_results for row in shard]
+
+def flatten_top_results(results):
+    """Wide label_1..score_N export table, built with pandas instead of row loops"""
+    base = pd.DataFrame(results, columns=["history_id", "text", "top_results"])
+    ranked = pd.json_normalize(results, record_path="top_results").reindex(columns=["label", "score"])
+    ranked["row"] = np.repeat(np.arange(len(base)), base["top_results"].str.len())
+    ranked["k"] = ranked.groupby("row").cumcount() + 1
+    ranked = ranked[ranked["k"] <= EXPORT_TOP_N]
+
+    # Missing slots (short or failed predictions) become "" / 0.0
+    ranks = range(1, EXPORT_TOP_N + 1)
+    labels = ranked.pivot(index="row", columns="k", values="label").reindex(index=base.index, columns=ranks).fillna("")
+    scores = ranked.pivot(index="row", columns="k", values="score").reindex(index=base.index, columns=ranks).fillna(0.0).astype(float)
+
+    export = base[["history_id", "text"]].copy()
+    for k in ranks:
+        export[f"label_{k}"] = labels[k]
+        export[f"score_{k}"] = scores[k]
+    return export
+
+def fetch_history_delta():
+    """Pull only records newer than what this session already holds, a page at a time"""
+    known = st.session_state.get('history_data', [])
+    if not known:
+        res = CLIENT.get("/history", params={"limit": HISTORY_FETCH})
+        res.raise_for_status()
+        st.session_state['history_data'] = res.json()
+        return
+
+    since = max(item['id'] for item in known)
+    fresh = []
+    while True:
+        res = CLIENT.get("/history", params={"since_id": since, "limit": HISTORY_FETCH})
+        res.raise_for_status()
+        page = res.json()  # oldest first
+        fresh.extend(page)
+        if len(page) < HISTORY_FETCH:
+            break
+        if len(fresh) >= HISTORY_KEEP:
+            # Too far behind to page through; just reload the newest records
+            res = CLIENT.get("/history", params={"limit": HISTORY_KEEP})
+            res.raise_for_status()
+            st.session_state['history_data'] = res.json()
+            return
+        since = page[-1]['id']
+    st.session_state['history_data'] = (fresh[::-1] + known)[:HISTORY_KEEP]
+
+def mark_history_reported(corrections):
+    """Mirror submitted corrections locally, since delta refreshes skip known rows"""
+    for item in st.session_state.get('history_data', []):
+        if item['id'] in corrections:
+            item['user_reported_wrong'] = True
+            item['correct_label_provided'] = corrections[item['id']]
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_explanation(history_id, text, label, confidence):
+    """LLM explanation for one prediction, generated at most once per history record"""
+    explain_payload = {"text": text, "label": label, "confidence": confidence}
+    res = CLIENT.post("/explain", json=explain_payload)
+    res.raise_for_status()
+    return res.json().get("explanation")
+
+# Derived views of one bulk run. `results_key` changes per run; the leading underscore
+# tells st.cache_data not to hash `_results`, so reruns skip both hashing and rebuilding.
+@st.cache_data(show_spinner=False, max_entries=4)
+def build_results_table(results_key, _results):
+    return pd.DataFrame(
+        _results, columns=["history_id", "text", "top_label", "confidence"]
+    ).rename(columns={
+        "history_id": "ID", "text": "Text", "top_label": "Prediction", "confidence": "Confidence"
+    }).astype({"Prediction": "category", "Confidence": "float32"})
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def build_feedback_frame(results_key, _results):
+    feedback_df = (
+        pd.DataFrame(_results, columns=["history_id", "text", "top_label", "confidence"])
+        .rename(columns={"top_label": "prediction"})
+        .astype({"prediction": "category", "confidence": "float32"})
+    )
+    # Confidence band computed in one vectorized comparison
+    feedback_df.insert(3, "band", pd.Categorical(
+        np.where(feedback_df["confidence"].to_numpy() > 0.8, "🟢", "🟠")
+    ))
+    feedback_df["report"] = False
+    feedback_df["correct_label"] = None
+    return feedback_df
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def build_export_csv(results_key, _results):
+    # Encode straight into a byte buffer instead of str -> bytes copy
+    buf = io.BytesIO()
+    flatten_top_results(_results).to_csv(buf, index=False, encoding='utf-8', lineterminator='\n')
+    return buf.getvalue()
+
+def refresh_labels():
+    """Drop cached labels after an admin write so the next render refetches"""
+    get_bootstrap.clear()
+    st.session_state.pop("_labels_cache", None)
 
 # --- SIDEBAR ---
 st.sidebar.title("Navigation")
@@ -58,55 +211,46 @@ if app_mode == "User Client":
 
                 with st.spinner("Running Model..."):
                     try:
-                        res = requests.post(f"{API_URL}/predict", json=payload)
+                        res = CLIENT.post("/predict", json=payload)
                         if res.status_code == 200:
                             data = res.json()
                             st.success("Done!")
                             st.session_state['feedback_id_input'] = data['history_id']
-                            st.markdown(f"**ID:** `{data['history_id']}`")
-
-                            results = data['top_results']
-                            top_label = results[0]['label']  # Get the #1 prediction
-                            confidence = results[0]['score']
-                            # --- NEW EXPLAINABILITY SECTION ---
-
-                            with st.expander(f"🤔 Why '{top_label}'? (Explainability)"):
-                                with st.spinner("Generating explanation..."):
-                                    try:
-                                        # 1. Construct the payload matching schemas.ExplainRequest
-                                        explain_payload = {
-                                            "text": query_text,
-                                            "label": top_label,
-                                            "confidence": confidence
-
-                                        }
-                                        st.info(f"Explain: {explain_payload}")
-                                        explain_response = requests.post(f"{API_URL}/explain", json=explain_payload)
-
-                                        # 3. Handle the response
-                                        if explain_response.status_code == 200:
-                                            result_data = explain_response.json()
-                                            explanation = result_data.get("explanation")
-
-                                            # Display the result
-                                            st.markdown(f"**Analysis:**")
-                                            st.write(explanation)
-                                        else:
-                                            st.error(
-                                                f"Failed to get explanation. Status: {explain_response.status_code}")
-
-                                    except Exception as e:
-                                        st.error(f"An error occurred while connecting to the server: {e}")
-
-                            results = data['top_results']
-                            df = pd.DataFrame(results).set_index('label')
-                            st.bar_chart(df['score'])
-                            st.table(df)
+                            st.session_state['last_prediction'] = data
                         else:
                             st.error(f"Error: {res.text}")
                     except Exception as e:
                         st.error(f"Connection Error: {e}")
 
+        # Kept in session_state so the result survives unrelated reruns
+        if st.session_state.get('last_prediction'):
+            data = st.session_state['last_prediction']
+            st.markdown(f"**ID:** `{data['history_id']}`")
+
+            results = data['top_results']
+            top_label = results[0]['label']  # Get the #1 prediction
+            confidence = results[0]['score']
+            # --- NEW EXPLAINABILITY SECTION ---
+
+            with st.expander(f"🤔 Why '{top_label}'? (Explainability)"):
+                # The LLM call only runs once the user asks for it
+                if st.toggle("Generate explanation", key=f"explain_{data['history_id']}"):
+                    with st.spinner("Generating explanation..."):
+                        try:
+                            explanation = fetch_explanation(data['history_id'], data['text'], top_label, confidence)
+
+                            # Display the result
+                            st.markdown(f"**Analysis:**")
+                            st.write(explanation)
+                        except httpx.HTTPStatusError as e:
+                            st.error(f"Failed to get explanation. Status: {e.response.status_code}")
+                        except Exception as e:
+                            st.error(f"An error occurred while connecting to the server: {e}")
+
+            df = pd.DataFrame(results).set_index('label')
+            st.bar_chart(df['score'])
+            st.table(df)
+
     # ==========================
     # TAB 2: BULK UPLOAD
     # ==========================
@@ -123,14 +267,17 @@ if app_mode == "User Client":
             if st.button("Process Bulk File"):
                 with st.spinner("Processing..."):
                     try:
-                        files = {"file": ("filename.json", uploaded_file, "application/json")}
-                        res = requests.post(f"{API_URL}/predict/bulk", files=files)
-                        
-                        if res.status_code == 200:
-                            st.session_state.bulk_results = res.json()['results']
-                            st.success(f"Processed {len(st.session_state.bulk_results)} items!")
+                        items = orjson.loads(uploaded_file.getvalue())
+                        if not isinstance(items, list) or not all(isinstance(i, dict) and "text" in i for i in items):
+                            st.error("JSON must be a list of objects with a 'text' key.")
                         else:
-                            st.error(f"Error: {res.text}")
+                            st.session_state.bulk_results = predict_bulk(items)
+                            st.session_state.bulk_results_key = uuid.uuid4().hex
+                            st.success(f"Processed {len(st.session_state.bulk_results)} items!")
+                    except ValueError:
+                        st.error("Invalid JSON file.")
+                    except httpx.HTTPStatusError as e:
+                        st.error(f"Error: {e.response.text}")
                     except Exception as e:
                         st.error(f"Connection Error: {e}")
 
@@ -143,81 +290,61 @@ if app_mode == "User Client":
             
             # --- VIEW A: DATAFRAME ---
             with view_tab:
-                simple_data = []
-                for row in st.session_state.bulk_results:
-                    simple_data.append({
-                        "ID": row['history_id'],
-                        "Text": row['text'],
-                        "Prediction": row['top_label'],
-                        "Confidence": f"{row['confidence']:.4f}"
-                    })
-                st.dataframe(pd.DataFrame(simple_data), use_container_width=True)
+                df_simple = build_results_table(st.session_state.bulk_results_key, st.session_state.bulk_results)
+                st.dataframe(
+                    df_simple,
+                    use_container_width=True,
+                    column_config={"Confidence": st.column_config.NumberColumn(format="%.4f")},
+                )
 
             # --- VIEW B: INTERACTIVE LIST ---
             with action_tab:
                 all_labels = get_global_labels()
-                
-                # Headers
-                h1, h2, h3, h4 = st.columns([3, 1, 1, 2])
-                h1.markdown("**Text**")
-                h2.markdown("**Prediction**")
-                h3.markdown("**Conf.**")
-                h4.markdown("**Action**")
-                st.divider()
-
-                for row in st.session_state.bulk_results:
-                    row_id = row['history_id']
-                    c1, c2, c3, c4 = st.columns([3, 1, 1, 2])
-                    
-                    with c1: st.write(row['text'])
-                    with c2: 
-                        color = "green" if row['confidence'] > 0.8 else "orange"
-                        st.markdown(f":{color}[{row['top_label']}]")
-                    with c3: st.write(f"{row['confidence']:.2f}")
-                    with c4: 
-                        is_wrong = st.checkbox("Report", key=f"chk_{row_id}")
-
-                    if is_wrong:
-                        with st.container():
-                            f1, f2 = st.columns([3, 1])
-                            with f1:
-                                correct_label = st.selectbox("Correct Label:", all_labels, key=f"sel_{row_id}")
-                            with f2:
-                                st.write("")
-                                st.write("")
-                                if st.button("Submit", key=f"btn_{row_id}"):
-                                    try:
-                                        requests.patch(f"{API_URL}/feedback", json={"history_id": row_id, "correct_label": correct_label})
-                                        st.success("Saved!")
-                                    except: st.error("Error")
-                    st.markdown("---")
+
+                # One grid widget for the whole batch instead of ~4 widgets per row
+                feedback_df = build_feedback_frame(st.session_state.bulk_results_key, st.session_state.bulk_results)
+
+                edited = st.data_editor(
+                    feedback_df,
+                    # Keyed per run, so edits from a previous upload never land on new rows
+                    key=f"fb_editor_{st.session_state.bulk_results_key}",
+                    hide_index=True,
+                    use_container_width=True,
+                    disabled=["history_id", "text", "prediction", "band", "confidence"],
+                    column_config={
+                        "history_id": st.column_config.NumberColumn("ID"),
+                        "text": st.column_config.TextColumn("Text", width="large"),
+                        "prediction": st.column_config.TextColumn("Prediction"),
+                        "band": st.column_config.TextColumn("", help="🟢 confidence > 0.8, 🟠 worth reviewing"),
+                        "confidence": st.column_config.NumberColumn("Conf.", format="%.2f"),
+                        "report": st.column_config.CheckboxColumn("Report"),
+                        "correct_label": st.column_config.SelectboxColumn("Correct Label", options=all_labels),
+                    },
+                )
+
+                # Reported rows with a chosen label (failed rows have no history record)
+                pending = edited[edited["report"] & edited["correct_label"].notna() & (edited["history_id"] > 0)]
+
+                # Flush every queued correction in a single request
+                if st.button(f"Submit All Corrections ({len(pending)})", disabled=pending.empty):
+                    try:
+                        batch = [
+                            {"history_id": int(h_id), "correct_label": label}
+                            for h_id, label in zip(pending["history_id"], pending["correct_label"])
+                        ]
+                        res = CLIENT.post("/feedback/bulk", json=batch)
+                        if res.status_code == 200:
+                            st.success(f"Saved {res.json()['updated']} corrections!")
+                            mark_history_reported({item["history_id"]: item["correct_label"] for item in batch})
+                        else:
+                            st.error(f"Error: {res.text}")
+                    except Exception as e:
+                        st.error(f"Connection Error: {e}")
 
             # --- CSV DOWNLOAD LOGIC (TOP 3) ---
             st.divider()
             
-            # Helper to flatten the JSON structure for CSV
-            csv_data = []
-            for item in st.session_state.bulk_results:
-                row = {
-                    "history_id": item['history_id'],
-                    "text": item['text'],
-                }
-                # Flatten top 3 results
-                top_res = item.get('top_results', [])
-                
-                # Loop 1 to 3
-                for i in range(3):
-                    if i < len(top_res):
-                        row[f"label_{i+1}"] = top_res[i]['label']
-                        row[f"score_{i+1}"] = top_res[i]['score']
-                    else:
-                        row[f"label_{i+1}"] = ""
-                        row[f"score_{i+1}"] = 0.0
-                
-                csv_data.append(row)
-
-            df_export = pd.DataFrame(csv_data)
-            csv = df_export.to_csv(index=False).encode('utf-8')
+            csv = build_export_csv(st.session_state.bulk_results_key, st.session_state.bulk_results)
             
             st.download_button(
                 "📥 Download Detailed Results (Top 3 Labels)",
@@ -231,13 +358,18 @@ if app_mode == "User Client":
     # 3. FEEDBACK & HISTORY SECTION
     st.subheader("📜 History & Feedback")
     
+    # Seed from the bootstrap payload; "Refresh History" then pulls deltas
+    if 'history_data' not in st.session_state:
+        try:
+            st.session_state['history_data'] = get_bootstrap()["history"]
+        except httpx.HTTPError:
+            pass  # backend unreachable; "Refresh History" retries
+
     if st.button("Refresh History"):
         try:
-            hist_res = requests.get(f"{API_URL}/history?limit=20")
-            if hist_res.status_code == 200:
-                st.session_state['history_data'] = hist_res.json()
-            else:
-                st.error("Failed to fetch history")
+            fetch_history_delta()
+        except httpx.HTTPStatusError:
+            st.error("Failed to fetch history")
         except:
             st.error("Backend offline")
 
@@ -246,7 +378,7 @@ if app_mode == "User Client":
         display_data = []
         for item in st.session_state['history_data']:
             # Extract top label for summary
-            top_prediction = item['model_results'][0]['label'] if item['model_results'] else "N/A"
+            top_prediction = item.get('top_label') or "N/A"
             display_data.append({
                 "ID": item['id'],
                 "Time": item['timestamp'],
@@ -255,7 +387,10 @@ if app_mode == "User Client":
                 "Validation Result": "❌" if item['user_reported_wrong'] else "✅"
             })
         
-        st.dataframe(pd.DataFrame(display_data))
+        df_history = pd.DataFrame(display_data)
+        if not df_history.empty:
+            df_history = df_history.astype({"Model Prediction": "category", "Validation Result": "category"})
+        st.dataframe(df_history)
 
         # Feedback Form
         st.write("### Report an Issue")
@@ -273,9 +408,10 @@ if app_mode == "User Client":
             
             if submitted:
                 payload = {"history_id": f_id, "correct_label": f_correct}
-                res = requests.patch(f"{API_URL}/feedback", json=payload)
+                res = CLIENT.patch("/feedback", json=payload)
                 if res.status_code == 200:
                     st.success("Feedback received! Thank you.")
+                    mark_history_reported({f_id: f_correct})
                 else:
                     st.error(f"Error: {res.text}")
 
@@ -311,9 +447,10 @@ elif app_mode == "Admin Dashboard":
                             st.error("Label name is required")
                         else:
                             payload = {"label": new_label, "description": desc_to_save}
-                            res = requests.post(f"{API_URL}/admin/labels", json=payload)
+                            res = CLIENT.post("/admin/labels", json=payload)
                             if res.status_code == 200:
                                 st.success(f"Label '{new_label}' saved!")
+                                refresh_labels()
                                 if "suggested_result" in st.session_state:
                                     del st.session_state.suggested_result
                                 st.rerun() # Refresh page to show in table
@@ -330,7 +467,7 @@ elif app_mode == "Admin Dashboard":
                     with st.spinner("Uploading labels..."):
                         try:
                             files = {"file": ("labels.json", bulk_label_file, "application/json")}
-                            res = requests.post(f"{API_URL}/admin/labels/bulk", files=files)
+                            res = CLIENT.post("/admin/labels/bulk", files=files)
                             
                             if res.status_code == 200:
                                 data = res.json()
@@ -341,6 +478,7 @@ elif app_mode == "Admin Dashboard":
                                     st.error(f"Errors: {data['errors']}")
                                 
                                 # Trigger refresh of the table below
+                                refresh_labels()
                                 time.sleep(1) 
                                 st.rerun()
                             else:
@@ -354,15 +492,12 @@ elif app_mode == "Admin Dashboard":
         st.subheader("Manage Existing Labels")
         
         # 1. Get current labels
-        try:
-            labels_data = requests.get(f"{API_URL}/labels").json()
-        except:
-            labels_data = []
-            st.error("Could not fetch labels.")
+        labels_data = get_labels_full()
 
         if labels_data:
             # Convert to DataFrame for display
             df_labels = pd.DataFrame(labels_data)
+            df_labels["id"] = pd.to_numeric(df_labels["id"], downcast="unsigned")
             st.dataframe(df_labels, use_container_width=True)
 
             st.write("### Edit or Delete")
@@ -390,9 +525,10 @@ elif app_mode == "Admin Dashboard":
 
                     if update_submitted:
                         payload = {"label": edit_name, "description": edit_desc}
-                        res = requests.put(f"{API_URL}/admin/labels/{selected_id}", json=payload)
+                        res = CLIENT.put(f"/admin/labels/{selected_id}", json=payload)
                         if res.status_code == 200:
                             st.success("Updated successfully!")
+                            refresh_labels()
                             st.rerun()
                         else:
                             st.error(f"Update failed: {res.text}")
@@ -404,9 +540,10 @@ elif app_mode == "Admin Dashboard":
                     st.warning(f"⚠️ Deleting '{selected_label_name}' cannot be undone.")
                 with col_btn:
                     if st.button("🗑️ Delete Label", type="secondary"):
-                        res = requests.delete(f"{API_URL}/admin/labels/{selected_id}")
+                        res = CLIENT.delete(f"/admin/labels/{selected_id}")
                         if res.status_code == 200:
                             st.success("Deleted successfully!")
+                            refresh_labels()
                             st.rerun()
                         else:
                             st.error(f"Delete failed: {res.text}")
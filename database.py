@@ -1,12 +1,34 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, JSON, Boolean
+from sqlalchemy import create_engine, event, insert, inspect, text, Column, Index, Integer, Float, String, DateTime, JSON, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
 
 DATABASE_URL = "sqlite:///./app_data.db"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Keep a small pool of warm connections instead of reopening the file per request
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=QueuePool,
+    pool_size=10,
+    max_overflow=20,
+)
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers run alongside a writer; NORMAL sync skips the per-commit fsync"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    cursor.execute("PRAGMA cache_size=-65536")     # 64 MB
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Short write-only sessions outside the request-scoped one; objects stay readable after commit
+WriteSessionLocal = sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
 
 Base = declarative_base()
 
@@ -15,7 +37,7 @@ class GlobalLabel(Base):
     id = Column(Integer, primary_key=True, index=True)
     label = Column(String, unique=True, index=True)
     description = Column(String, nullable=True)
-    is_active = Column(Boolean, default=True)
+    is_active = Column(Boolean, default=True, index=True)
 
 class QueryHistory(Base):
     __tablename__ = "query_history"
@@ -23,9 +45,43 @@ class QueryHistory(Base):
     query_text = Column(String)
     # We store results as a JSON string or JSON type
     model_results = Column(JSON) 
+    # Top-1 copied out of model_results so list views don't decode the JSON
+    top_label = Column(String, index=True, nullable=True)
+    top_score = Column(Float, nullable=True)
     user_reported_wrong = Column(Boolean, default=False)
     correct_label_provided = Column(String, nullable=True) # If user corrects it
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+# Serves the `ORDER BY timestamp DESC LIMIT n` history path
+Index("ix_query_history_timestamp", QueryHistory.timestamp.desc())
+
+def bulk_insert_history(rows):
+    """Insert many QueryHistory rows with one statement and one commit; returns ids in input order"""
+    if not rows:
+        return []
+    with engine.begin() as conn:
+        result = conn.execute(
+            insert(QueryHistory).returning(QueryHistory.id, sort_by_parameter_order=True),
+            rows,
+        )
+        return [row.id for row in result]
+
+def migrate_db():
+    """Bring a database created by an older version up to the current schema"""
+    columns = {c["name"] for c in inspect(engine).get_columns("query_history")}
+    with engine.begin() as conn:
+        if "top_label" not in columns:
+            conn.execute(text("ALTER TABLE query_history ADD COLUMN top_label VARCHAR"))
+            conn.execute(text("UPDATE query_history SET top_label = json_extract(model_results, '$[0].label')"))
+        if "top_score" not in columns:
+            conn.execute(text("ALTER TABLE query_history ADD COLUMN top_score FLOAT"))
+            conn.execute(text("UPDATE query_history SET top_score = json_extract(model_results, '$[0].score')"))
+
+    # create_all() skips indexes on tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    migrate_db()
\ No newline at end of file
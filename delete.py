@@ -4,10 +4,13 @@ import sqlite3
 DB_PATH = "app_data.db"
 TABLE_NAME = "query_history"
 PRIMARY_KEY = "id"   # column name to identify each row
+BATCH_SIZE = 500     # ids per DELETE, below SQLite's bound-parameter limit
 # -----------------
 
 conn = sqlite3.connect(DB_PATH)
 cursor = conn.cursor()
+cursor.execute("PRAGMA journal_mode=WAL")
+cursor.execute("PRAGMA synchronous=NORMAL")
 
 # Fetch all rows first
 cursor.execute(f"SELECT {PRIMARY_KEY}, * FROM {TABLE_NAME}")
@@ -16,6 +19,7 @@ rows = cursor.fetchall()
 print(f"Total rows found: {len(rows)}")
 print("Press ENTER to delete a row, or type anything to skip.\n")
 
+to_delete = []
 for row in rows:
     row_id = row[0]
     print(f"Row ID = {row_id} | Data = {row}")
@@ -23,11 +27,18 @@ for row in rows:
     user_input = input("Delete this row? (ENTER = delete / anything else = skip): ")
 
     if user_input.strip() == "":
-        cursor.execute(f"DELETE FROM {TABLE_NAME} WHERE {PRIMARY_KEY} = ?", (row_id,))
-        conn.commit()
-        print("✔ Deleted\n")
+        to_delete.append(row_id)
+        print("✔ Marked for deletion\n")
     else:
         print("⏭ Skipped\n")
 
-print("Done!")
+# Delete everything marked in one transaction (a single commit / fsync)
+cursor.execute("BEGIN IMMEDIATE")
+for i in range(0, len(to_delete), BATCH_SIZE):
+    batch = to_delete[i:i + BATCH_SIZE]
+    placeholders = ",".join("?" * len(batch))
+    cursor.execute(f"DELETE FROM {TABLE_NAME} WHERE {PRIMARY_KEY} IN ({placeholders})", batch)
+conn.commit()
+
+print(f"Done! Deleted {len(to_delete)} rows.")
 conn.close()
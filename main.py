@@ -1,8 +1,12 @@
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, Depends, HTTPException
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import exists
+from sqlalchemy.orm import Session, defer
 from typing import List
 from fastapi import UploadFile, File
-import json
+from fastapi.concurrency import run_in_threadpool
+import orjson
+import time
 import database
 import schemas
 import ml_engine
@@ -23,17 +27,60 @@ def startup_event():
     database.init_db()
     ml_engine.ml_instance.load_model()
 
-# --- Helper: Background Task to Save History ---
-def save_prediction_to_db(db: Session, text: str, results: list):
-    """Saves the query and result to SQLite without blocking the API response"""
-    db_item = database.QueryHistory(
-        query_text=text,
-        model_results=results, # SQLAlchemy handles JSON serialization if configured or use simple list
-    )
-    db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
-    return db_item.id
+    # Have the global label vectors ready (from disk, encoding only new labels) before the first request
+    db = database.SessionLocal()
+    try:
+        ml_engine.ml_instance.warm_labels(get_active_labels(db))
+    finally:
+        db.close()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ml_engine.inference_queue.stop()
+    ml_engine.ml_instance.persist_label_cache()
+
+# --- Helper: Save History ---
+def history_fields(text: str, results: list):
+    """Column values for one QueryHistory row"""
+    return {
+        "query_text": text,
+        "model_results": results, # SQLAlchemy handles JSON serialization if configured or use simple list
+        "top_label": results[0]["label"] if results else None,
+        "top_score": results[0]["score"] if results else None,
+    }
+
+def save_prediction_to_db(text: str, results: list):
+    """
+    Saves the query and result to SQLite and returns the new history id.
+    Runs inside the request (the id is part of the response), on its own short write session.
+    """
+    with database.WriteSessionLocal() as db:
+        db_item = database.QueryHistory(**history_fields(text, results))
+        db.add(db_item)
+        db.commit()
+        return db_item.id  # expire_on_commit=False: no re-SELECT to read the id
+
+# --- Helper: In-process cache of active label names ---
+LABEL_CACHE_TTL = 30  # seconds
+LABEL_LOOKUP_BATCH = 500  # names per IN (...) lookup, below SQLite's bound-parameter limit
+BULK_LABEL_ITEMS = TypeAdapter(List[schemas.BulkLabelItem])
+_label_cache = {"ts": 0.0, "labels": []}
+
+def get_active_labels(db: Session):
+    """Active global label names, re-queried at most every LABEL_CACHE_TTL seconds"""
+    now = time.time()
+    if now - _label_cache["ts"] > LABEL_CACHE_TTL:
+        rows = db.query(database.GlobalLabel.label).filter(database.GlobalLabel.is_active == True).all()
+        _label_cache.update(labels=[row.label for row in rows], ts=now)
+    return _label_cache["labels"]
+
+def invalidate_label_cache():
+    """Force the next get_active_labels() to hit the DB (call after any label write)"""
+    _label_cache["ts"] = 0.0
+
+def label_exists(db: Session, name: str) -> bool:
+    """EXISTS check on the label name (no ORM object is loaded)"""
+    return db.query(exists().where(database.GlobalLabel.label == name)).scalar()
 
 # --- Client Endpoints ---
 
@@ -43,7 +90,7 @@ def get_global_labels(db: Session = Depends(get_db)):
     return db.query(database.GlobalLabel).filter(database.GlobalLabel.is_active == True).all()
 
 @app.post("/predict", response_model=schemas.PredictResponse)
-def predict(request: schemas.PredictRequest, db: Session = Depends(get_db)):
+async def predict(request: schemas.PredictRequest, db: Session = Depends(get_db)):
     """
     1. Takes text input + optional custom labels
     2. Merges custom labels with global DB labels
@@ -53,26 +100,22 @@ def predict(request: schemas.PredictRequest, db: Session = Depends(get_db)):
     """
     
     # 1. Fetch global labels
-    global_labels_objs = db.query(database.GlobalLabel).filter(database.GlobalLabel.is_active == True).all()
-    candidate_labels = [l.label for l in global_labels_objs]
+    global_labels = await run_in_threadpool(get_active_labels, db)
     
     # 2. Add custom client labels if provided
-    if request.custom_labels:
-        candidate_labels.extend(request.custom_labels)
-    
-    # Ensure unique labels and minimum requirement
-    candidate_labels = list(set(candidate_labels))
+    # Ensure unique labels, keeping order so the same request always maps to the same label matrix
+    candidate_labels = list(dict.fromkeys([*global_labels, *(request.custom_labels or [])]))
     if not candidate_labels:
         raise HTTPException(status_code=400, detail="No labels provided (Global or Custom)")
 
-    # 3. Run Model
+    # 3. Run Model (micro-batched with other concurrent requests)
     try:
-        results = ml_engine.ml_instance.predict(request.text, candidate_labels)
+        results = await ml_engine.inference_queue.submit(request.text, candidate_labels)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    # 4. Save to DB (Synchronously here to get the ID back for the user)
-    history_id = save_prediction_to_db(db, request.text, results)
+    # 4. Save to DB (before responding, to get the ID back for the user)
+    history_id = await run_in_threadpool(save_prediction_to_db, request.text, results)
 
     return {
         "history_id": history_id,
@@ -93,10 +136,53 @@ def report_wrong_prediction(feedback: schemas.FeedbackRequest, db: Session = Dep
     
     return {"message": "Feedback received. Thank you for improving the model."}
 
-@app.get("/history", response_model=List[schemas.HistoryResponse])
-def get_history(limit: int = 10, db: Session = Depends(get_db)):
-    """Serve history of clients"""
-    return db.query(database.QueryHistory).order_by(database.QueryHistory.timestamp.desc()).limit(limit).all()
+@app.post("/feedback/bulk")
+def report_wrong_predictions_bulk(feedback: List[schemas.FeedbackRequest], db: Session = Depends(get_db)):
+    """Apply many corrections in a single transaction"""
+    corrections = {item.history_id: item.correct_label for item in feedback}
+    records = db.query(database.QueryHistory).filter(database.QueryHistory.id.in_(corrections)).all()
+
+    for record in records:
+        record.user_reported_wrong = True
+        record.correct_label_provided = corrections[record.id]
+    db.commit()
+
+    found = {record.id for record in records}
+    return {
+        "message": "Feedback received. Thank you for improving the model.",
+        "updated": len(records),
+        "missing": [h_id for h_id in corrections if h_id not in found]
+    }
+
+@app.get("/history", response_model=List[schemas.HistorySummary])
+def get_history(limit: int = 10, since_id: int = 0, db: Session = Depends(get_db)):
+    """
+    Serve history of clients: the newest `limit` records, or, when `since_id` is given,
+    the next `limit` records after it in id order (oldest first, so callers can page forward).
+    """
+    # The list only needs the top label/score columns; skip loading and parsing the results JSON
+    query = db.query(database.QueryHistory).options(defer(database.QueryHistory.model_results))
+    if since_id:
+        query = query.filter(database.QueryHistory.id > since_id).order_by(database.QueryHistory.id.asc())
+    else:
+        query = query.order_by(database.QueryHistory.timestamp.desc())
+    return query.limit(limit).all()
+
+@app.get("/history/{history_id}", response_model=schemas.HistoryResponse)
+def get_history_item(history_id: int, db: Session = Depends(get_db)):
+    """One history record with its full Top-K results"""
+    record = db.get(database.QueryHistory, history_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="History record not found")
+    return record
+
+@app.get("/bootstrap", response_model=schemas.BootstrapResponse)
+def bootstrap(limit: int = 20, db: Session = Depends(get_db)):
+    """Labels and recent history in one round-trip for the client's first render"""
+    return {
+        "labels": get_global_labels(db=db),
+        "history": get_history(limit=limit, db=db)
+    }
 
 # --- Admin / Training Endpoints ---
 
@@ -110,14 +196,15 @@ def update_global_label(label_id: int, label_data: schemas.LabelUpdate, db: Sess
 
     # 2. Check for duplicates if the name is changing
     if label_item.label != label_data.label:
-        existing = db.query(database.GlobalLabel).filter(database.GlobalLabel.label == label_data.label).first()
-        if existing:
+        if label_exists(db, label_data.label):
             raise HTTPException(status_code=400, detail="Label name already exists")
 
     # 3. Update fields
+    ml_engine.ml_instance.forget_labels(label_item.label)
     label_item.label = label_data.label
     label_item.description = label_data.description
     db.commit()
+    invalidate_label_cache()
     db.refresh(label_item)
     return {"message": f"Label updated to '{label_data.label}'"}
 
@@ -128,20 +215,22 @@ def delete_global_label(label_id: int, db: Session = Depends(get_db)):
     if not label_item:
         raise HTTPException(status_code=404, detail="Label not found")
     
+    ml_engine.ml_instance.forget_labels(label_item.label)
     db.delete(label_item)
     db.commit()
+    invalidate_label_cache()
     return {"message": "Label deleted successfully"}
 
 @app.post("/admin/labels")
 def add_global_label(label_data: schemas.LabelCreate, db: Session = Depends(get_db)):
     """Admin: Add a new category to the global list"""
-    existing = db.query(database.GlobalLabel).filter(database.GlobalLabel.label == label_data.label).first()
-    if existing:
+    if label_exists(db, label_data.label):
         raise HTTPException(status_code=400, detail="Label already exists")
     
     new_label = database.GlobalLabel(label=label_data.label, description=label_data.description)
     db.add(new_label)
     db.commit()
+    invalidate_label_cache()
     return {"message": f"Label '{label_data.label}' added."}
 
 @app.post("/admin/model/swap")
@@ -173,61 +262,49 @@ def trigger_fine_tuning():
 
 
 
-@app.post("/predict/bulk", response_model=schemas.BulkResponse)
-async def bulk_predict(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """
-    Upload a JSON file containing a list of texts.
-    Format: [{"text": "..."} , {"text": "..."}]
-    """
-    
-    # 1. Read and Parse the File
-    try:
-        content = await file.read()
-        data = json.loads(content)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid JSON file.")
-
-    # Validate format (Must be a list of dicts with 'text')
-    if not isinstance(data, list) or not all("text" in item for item in data):
-        raise HTTPException(status_code=400, detail="JSON must be a list of objects with a 'text' key.")
-
+def run_bulk_prediction(texts: List[str], db: Session):
+    """Shared classification loop behind both bulk endpoints"""
     # Limit size for safety (e.g., max 100 items for this demo)
-    if len(data) > 100:
+    if len(texts) > 100:
         raise HTTPException(status_code=400, detail="Batch size limit exceeded (Max 100 items).")
 
     # 2. Get Labels
-    global_labels_objs = db.query(database.GlobalLabel).filter(database.GlobalLabel.is_active == True).all()
-    candidate_labels = [l.label for l in global_labels_objs]
+    candidate_labels = get_active_labels(db)
     
     if not candidate_labels:
         raise HTTPException(status_code=400, detail="No global labels found in database.")
 
-    results_list = []
+    # 3. Classify the whole batch in one engine call
+    try:
+        predictions_list = ml_engine.ml_instance.predict_batch(texts, candidate_labels)
+    except Exception:
+        # Fall back to one text at a time so a single bad item doesn't fail the whole batch
+        predictions_list = []
+        for text_input in texts:
+            try:
+                predictions_list.append(ml_engine.ml_instance.predict(text_input, candidate_labels))
+            except Exception as e:
+                # If one fails, we log it but don't crash the whole batch
+                predictions_list.append([])
+
+    # 4. Save every successful prediction to History in a single INSERT
+    history_ids = iter(database.bulk_insert_history([
+        history_fields(text_input, predictions)
+        for text_input, predictions in zip(texts, predictions_list) if predictions
+    ]))
 
-    # 3. Process Loop (Practical approach)
-    # Note: In a massive production app, we would use 'batching' inside the ML engine,
-    # but a loop is safer and easier to debug for this setup.
-    for item in data:
-        text_input = item['text']
-        
-        # Run Prediction
-        try:
-            # We reuse the existing engine
-            predictions = ml_engine.ml_instance.predict(text_input, candidate_labels)
+    results_list = []
+    for text_input, predictions in zip(texts, predictions_list):
+        if predictions:
             top_result = predictions[0] # Get the #1 result
-            
-            # Save to History (Optional: remove this line if you don't want bulk clogging DB)
-            h_id = save_prediction_to_db(db, text_input, predictions)
-            
             results_list.append({
-                "history_id": h_id,
+                "history_id": next(history_ids),
                 "text": text_input,
                 "top_label": top_result['label'],
                 "confidence": top_result['score'],
                 "top_results": predictions[:3]
             })
-        except Exception as e:
-            # If one fails, we log it but don't crash the whole batch
+        else:
             results_list.append({
                 "history_id": -1,
                 "text": text_input, 
@@ -241,46 +318,86 @@ async def bulk_predict(file: UploadFile = File(...), db: Session = Depends(get_d
         "results": results_list
     }
 
+@app.post("/predict/bulk", response_model=schemas.BulkResponse)
+def bulk_predict(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """
+    Upload a JSON file containing a list of texts.
+    Format: [{"text": "..."} , {"text": "..."}]
+    """
+    
+    # 1. Read and Parse the File
+    try:
+        content = file.file.read()
+        data = orjson.loads(content)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON file.")
+
+    # Validate format (Must be a list of dicts with 'text')
+    if not isinstance(data, list) or not all("text" in item for item in data):
+        raise HTTPException(status_code=400, detail="JSON must be a list of objects with a 'text' key.")
+
+    return run_bulk_prediction([item['text'] for item in data], db)
+
+@app.post("/predict/bulk/json", response_model=schemas.BulkResponse)
+def bulk_predict_json(items: List[schemas.BulkTextItem], db: Session = Depends(get_db)):
+    """
+    Same as /predict/bulk, but takes the list as a JSON request body.
+    Format: [{"text": "..."} , {"text": "..."}]
+    """
+    return run_bulk_prediction([item.text for item in items], db)
+
 @app.post("/admin/labels/bulk")
-async def bulk_add_labels(file: UploadFile = File(...), db: Session = Depends(get_db)):
+def bulk_add_labels(file: UploadFile = File(...), db: Session = Depends(get_db)):
     """
     Bulk upload labels from a JSON file.
     Format: [{"label": "Sports", "description": "..."}, {"label": "Politics"}]
     """
     try:
-        content = await file.read()
-        data = json.loads(content)
+        content = file.file.read()
+        data = orjson.loads(content)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON file.")
 
-    if not isinstance(data, list):
-        raise HTTPException(status_code=400, detail="JSON must be a list of objects.")
+    try:
+        items = BULK_LABEL_ITEMS.validate_python(data)
+    except ValidationError:
+        raise HTTPException(status_code=400, detail="JSON must be a list of objects with string 'label'/'description' keys.")
 
     added_count = 0
     skipped_count = 0
     errors = []
 
-    for item in data:
-        label_name = item.get("label")
-        description = item.get("description")
+    # Look up the file's names in a few batched queries instead of one per item
+    names = list(dict.fromkeys(item.label for item in items if item.label))
+    existing = set()
+    for i in range(0, len(names), LABEL_LOOKUP_BATCH):
+        batch = names[i:i + LABEL_LOOKUP_BATCH]
+        existing.update(
+            row.label for row in
+            db.query(database.GlobalLabel.label).filter(database.GlobalLabel.label.in_(batch))
+        )
+
+    for item in items:
+        label_name = item.label
+        description = item.description
 
         if not label_name:
             continue
 
-        # Check if label already exists
-        existing = db.query(database.GlobalLabel).filter(database.GlobalLabel.label == label_name).first()
-        
-        if existing:
+        if label_name in existing:
             skipped_count += 1
         else:
             try:
                 new_label = database.GlobalLabel(label=label_name, description=description)
                 db.add(new_label)
+                # Repeats later in the same file count as skipped, not as a second insert
+                existing.add(label_name)
                 added_count += 1
             except Exception as e:
                 errors.append(f"Error adding {label_name}: {str(e)}")
 
     db.commit()
+    invalidate_label_cache()
 
     return {
         "message": "Bulk processing complete",
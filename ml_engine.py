@@ -1,49 +1,312 @@
-from transformers import pipeline as standard_pipeline
+from transformers import AutoModel, AutoModelForCausalLM, AutoTokenizer
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import os
+import tempfile
+import threading
+import numpy as np
 import torch
 import torch.nn.functional as F
 
+try:
+    import faiss  # optional: exact inner-product search for large label sets on CPU
+except ImportError:
+    faiss = None
+
+# Padded sequence lengths used when the embedder is compiled; the last one caps truncation
+SEQ_BUCKETS = (16, 32, 64, 128, 256)
+
 class MLEngine:
     def __init__(self):
         self.classifier = None
         self.generator = None
+        self.generator_tokenizer = None
 
         self.embedding_model_name = "sentence-transformers/all-mpnet-base-v2"
+        self.tokenizer = None
         self.embedder = None
         self.generator_name = "Qwen/Qwen2.5-0.5B-Instruct"
 
-        self.device = 0 if torch.cuda.is_available() else -1
+        # label text -> unit vector, plus an LRU of label tuple -> stacked matrix
+        self.label_emb_cache = {}
+        self.label_matrices = OrderedDict()
+        self.label_matrix_limit = 32
+        # label tuple -> faiss index, used on CPU once a label set reaches `faiss_min_labels`
+        self.label_indexes = {}
+        self.faiss_min_labels = 1000
+        # (model tag, text, sorted labels) -> top results; the tag changes whenever the embedder is reloaded
+        self.prediction_cache = OrderedDict()
+        self.prediction_cache_limit = 10000
+        self.model_tag = 0
+        self.label_cache_limit = 10000
+        # Label vectors survive restarts here (fp16), tagged with the model that produced them
+        self.label_cache_path = "label_embeddings.npz"
+        self.batch_size = 32
+
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # Reduced-precision weights: fp16 on GPU, dynamic int8 Linear layers for the CPU embedder
+        self.dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+        self.quantize_cpu = True
+        self.embedder_quantized = False
+        # torch.compile pays off with CUDA graphs on GPU; on CPU the int8 eager path is used
+        self.compile_embedder = torch.cuda.is_available()
+        # CUDA graph trees are thread-local, so compiled forwards (warmup included) all run
+        # on this one thread, whichever request thread asked for them
+        self._inference_thread = threading.local()
+        self.inference_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="inference", initializer=self._mark_inference_thread
+        )
 
     def load_model(self):
         print("-" * 50)
 
-        print(f"Loading Embedder ({self.embedding_model_name})...")
-        self.embedder = standard_pipeline(
-            "feature-extraction",
-            model=self.embedding_model_name,
-            device=self.device
-        )
-        print("Embedder loaded.")
+        self._load_embedder(self.embedding_model_name)
 
         # --- LOAD GENERATOR (Standard) ---
         print(f"Loading Generator ({self.generator_name})...")
-        self.generator = standard_pipeline(
-            "text-generation",
-            model=self.generator_name,
-            device=self.device,
-            max_new_tokens=256,
-            do_sample=False
-        )
+        self.generator_tokenizer = AutoTokenizer.from_pretrained(self.generator_name)
+        self.generator = AutoModelForCausalLM.from_pretrained(
+            self.generator_name, dtype=self.dtype
+        ).to(self.device).eval()
+        # Greedy decoding is deterministic, so repeat explanations can be served from memory
+        self._generate = functools.lru_cache(maxsize=4096)(self._generate_uncached)
 
         print("-" * 50)
 
+    def _load_embedder(self, model_name: str):
+        """
+        Load, prepare and warm up `model_name`, then install it. Nothing on the engine
+        changes until all of that has worked, so a failed swap leaves the old model serving.
+        """
+        print(f"Loading Embedder ({model_name})...")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name, dtype=self.dtype)
+        quantized = False
+        if self.device.type == "cpu" and self.quantize_cpu:
+            model, quantized = self._quantize(model)
+        model = model.to(self.device).eval()
+        if self.compile_embedder:
+            model = torch.compile(model, mode="reduce-overhead", fullgraph=False)
+
+        self._warmup(tokenizer, model)
+
+        self.embedding_model_name = model_name
+        self.tokenizer = tokenizer
+        self.embedder = model
+        self.embedder_quantized = quantized
+        self.forget_labels()
+        self.model_tag += 1  # cached predictions belong to the previous model
+        self.load_label_cache()
+        print("Embedder loaded.")
+
+    def _quantize(self, model):
+        """
+        Dynamic int8 Linear layers for CPU; returns (model, quantized). torch has deprecated
+        this API, so if it is missing or fails the fp32 model is used instead.
+        """
+        try:
+            return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8), True
+        except Exception as e:
+            print(f"int8 quantization unavailable ({e}); using the fp32 embedder.")
+            return model, False
+
+    def _mark_inference_thread(self):
+        self._inference_thread.active = True
+
+    def _warmup(self, tokenizer, model):
+        """
+        Run the model once per input shape real traffic produces, so compilation happens
+        here rather than on a request: every length bucket at batch 1 and at a dynamic batch.
+        """
+        if not self.compile_embedder:
+            self._encode(tokenizer, model, ["warmup"])
+            return
+        for size in SEQ_BUCKETS:
+            for batch in (1, 2):
+                enc = tokenizer(["warmup"] * batch, padding="max_length", truncation=True, max_length=size, return_tensors="pt")
+                self._forward(model, enc)
+
+    def reload_model(self, model_name: str):
+        """Swap the embedding model; cached label vectors belong to the old one"""
+        self._load_embedder(model_name)
+
+    def forget_labels(self, *labels):
+        """Drop cached vectors for `labels` (all of them when called with no arguments)"""
+        if labels:
+            for label in labels:
+                self.label_emb_cache.pop(label, None)
+        else:
+            self.label_emb_cache = {}
+        self.label_matrices.clear()
+        self.label_indexes.clear()
+
+    def load_label_cache(self):
+        """Seed the label vector cache from disk, if the file was written by the current model"""
+        if not os.path.exists(self.label_cache_path):
+            return
+        try:
+            with np.load(self.label_cache_path) as data:
+                if str(data["model"]) != self.embedding_model_name:
+                    return
+                labels = data["labels"].tolist()
+                vectors = F.normalize(torch.from_numpy(data["vectors"].astype(np.float32)), dim=1).to(self.device)
+        except Exception as e:
+            print(f"Ignoring label cache {self.label_cache_path}: {e}")
+            return
+        self.label_emb_cache.update(zip(labels, vectors))
+        print(f"Loaded {len(labels)} cached label vectors.")
+
+    def persist_label_cache(self):
+        """
+        Write the label vector cache to disk (replaces the previous file atomically).
+        Each writer uses its own temp file, so several uvicorn workers can persist at once.
+        """
+        if not self.label_emb_cache:
+            return
+        labels = list(self.label_emb_cache)
+        vectors = torch.stack([self.label_emb_cache[label] for label in labels])
+        directory = os.path.dirname(os.path.abspath(self.label_cache_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="label_embeddings.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    model=np.array(self.embedding_model_name),
+                    labels=np.array(labels),
+                    vectors=vectors.to(torch.float16).cpu().numpy(),
+                )
+            os.replace(tmp_path, self.label_cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def warm_labels(self, labels: list):
+        """Encode whichever of `labels` aren't cached yet, saving the cache if anything was added"""
+        if not labels:
+            return
+        known = len(self.label_emb_cache)
+        self._label_matrix(list(labels))
+        if len(self.label_emb_cache) != known:
+            self.persist_label_cache()
+
+    def _label_matrix(self, labels: list, texts: list = ()):
+        """
+        Stacked unit vectors for `labels`, encoding only the ones not cached yet.
+        Also encodes `texts` (in the same forward pass as the missing labels, when that is
+        exact); returns (matrix, text vectors).
+        """
+        texts = list(texts)
+        key = tuple(labels)
+        matrix = self.label_matrices.get(key)
+        if matrix is not None:
+            try:
+                self.label_matrices.move_to_end(key)
+            except KeyError:
+                pass  # evicted by another thread in between; still a valid matrix
+            return matrix, (self._embed(texts) if texts else None)
+
+        # Work from local references: admin edits (forget_labels) and model swaps change
+        # the shared cache from other threads while the forward pass below runs
+        cache = self.label_emb_cache
+        found = {}
+        for label in dict.fromkeys(labels):
+            vector = cache.get(label)
+            if vector is not None:
+                found[label] = vector
+        missing = [label for label in dict.fromkeys(labels) if label not in found]
+        if missing:
+            # Custom labels arrive per request; don't let them grow the cache forever
+            if len(cache) + len(missing) > self.label_cache_limit:
+                cache = dict(found)
+                self.label_emb_cache = cache
+
+        # Dynamic int8 picks activation scales per batch, so there a fused batch would make
+        # the stored label vectors depend on whichever texts arrived with them
+        if missing and texts and not self.embedder_quantized:
+            vectors = self._embed(missing + texts)
+            label_vectors, text_vectors = vectors[:len(missing)], vectors[len(missing):]
+        else:
+            label_vectors = self._embed(missing) if missing else ()
+            text_vectors = self._embed(texts) if texts else None
+        for label, vector in zip(missing, label_vectors):
+            found[label] = vector
+            cache[label] = vector
+
+        matrix = torch.stack([found[label] for label in labels])
+        # Small LRU: the global label set plus the most recent custom-label variants
+        # (skipped if the cache was replaced meanwhile, e.g. by a model swap)
+        if self.label_emb_cache is cache:
+            self.label_matrices[key] = matrix
+        while len(self.label_matrices) > self.label_matrix_limit:
+            try:
+                self.label_matrices.popitem(last=False)
+            except KeyError:
+                break
+        return matrix, text_vectors
+
+    def _label_index(self, labels: list, matrix):
+        """faiss IndexFlatIP over the label matrix (inner product == cosine for unit rows)"""
+        key = tuple(labels)
+        index = self.label_indexes.get(key)
+        if index is None:
+            index = faiss.IndexFlatIP(matrix.shape[1])
+            index.add(np.ascontiguousarray(matrix.cpu().numpy(), dtype=np.float32))
+            if len(self.label_indexes) >= self.label_matrix_limit:
+                self.label_indexes.pop(next(iter(self.label_indexes)), None)
+            self.label_indexes[key] = index
+        return index
+
+    def _tokenize(self, tokenizer, texts: list):
+        """
+        Tokenize a batch. Compiled graphs are specialized per shape, so on that path
+        pad up to the next length bucket instead of to the longest text.
+        """
+        max_length = SEQ_BUCKETS[-1]
+        if not self.compile_embedder:
+            return tokenizer(texts, padding=True, truncation=True, max_length=max_length, return_tensors="pt")
+
+        enc = tokenizer(texts, truncation=True, max_length=max_length)
+        longest = max(len(ids) for ids in enc["input_ids"])
+        bucket = next(size for size in SEQ_BUCKETS if size >= longest)
+        return tokenizer.pad(enc, padding="max_length", max_length=bucket, return_tensors="pt")
+
+    def _embed(self, texts: list):
+        """Encode a batch of texts with the installed embedder"""
+        return self._encode(self.tokenizer, self.embedder, texts)
+
+    def _encode(self, tokenizer, model, texts: list):
+        """
+        Encode a batch of texts in one forward pass.
+        Returns L2-normalized mean-pooled vectors (padding masked out), one row per text.
+        """
+        return self._forward(model, self._tokenize(tokenizer, texts))
+
+    def _forward(self, model, enc):
+        if self.compile_embedder and not getattr(self._inference_thread, "active", False):
+            return self.inference_executor.submit(self._forward_here, model, enc).result()
+        return self._forward_here(model, enc)
+
+    @torch.inference_mode()
+    def _forward_here(self, model, enc):
+        enc = enc.to(self.device)
+        if self.compile_embedder and enc["input_ids"].shape[0] > 1:
+            # Leave only the batch dimension dynamic (size 1 is always specialized);
+            # marked after the device copy, since that creates new tensors
+            for tensor in enc.values():
+                torch._dynamo.mark_dynamic(tensor, 0)
+        with torch.autocast(self.device.type, dtype=torch.float16, enabled=self.device.type == "cuda"):
+            hidden = model(**enc).last_hidden_state.float()  # pool in fp32 even for fp16 weights
+        mask = enc["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        return F.normalize(pooled, dim=1)
+
     def get_embedding(self, text: str):
-        if not self.embedder:
+        if self.embedder is None:
             raise Exception("Embedder not loaded")
 
-        output = self.embedder(text, truncation=True)[0]
-        # Convert nested list → flat vector
-        embedding = [float(x) for x in output]
-        return embedding
+        return self._embed([text])[0].tolist()
 
 
     def predict(self, text: str, labels: list):
@@ -51,29 +314,84 @@ class MLEngine:
         Predict using embedding similarity instead of zero-shot classifier.
         labels: list of strings (label descriptions)
         """
-        if not self.embedder:
+        return self.predict_batch([text], labels)[0]
+
+    def predict_batch(self, texts: list, labels: list):
+        """
+        Top-5 labels for every text. Results are deterministic for a given model and
+        label set, so repeated texts are answered from an LRU (treat results as read-only).
+        """
+        if self.embedder is None:
             raise Exception("Embedder (MPNet) not loaded")
 
-        # ---- 1. Embed input text ----
-        text_emb = self.embedder(text, truncation=True)[0]
-        text_emb = torch.tensor(text_emb, dtype=torch.float32).mean(dim=0)  # pooled vector
+        label_key = tuple(sorted(labels))
+        results = {}
+        for text in dict.fromkeys(texts):
+            key = (self.model_tag, text, label_key)
+            cached = self.prediction_cache.get(key)
+            if cached is not None:
+                try:
+                    self.prediction_cache.move_to_end(key)
+                except KeyError:
+                    pass  # evicted by another thread in between
+                results[text] = cached
 
-        # ---- 2. Embed each label ----
-        similarities = []
-        for label in labels:
-            label_emb = self.embedder(label, truncation=True)[0]
-            label_emb = torch.tensor(label_emb, dtype=torch.float32).mean(dim=0)
+        missing = [text for text in dict.fromkeys(texts) if text not in results]
+        if missing:
+            for text, predictions in zip(missing, self._score_batch(missing, labels)):
+                results[text] = predictions
+                self.prediction_cache[(self.model_tag, text, label_key)] = predictions
+            while len(self.prediction_cache) > self.prediction_cache_limit:
+                try:
+                    self.prediction_cache.popitem(last=False)
+                except KeyError:
+                    break
 
-            # ---- 3. Cosine similarity ----
-            sim = F.cosine_similarity(text_emb, label_emb, dim=0).item()
+        return [results[text] for text in texts]
 
-            similarities.append({"label": label, "score": float(sim)})
-        # ---- 4. Sort & return top 5 ----
-        similarities.sort(key=lambda x: x["score"], reverse=True)
-        return similarities[:5]
+    def _score_batch(self, texts: list, labels: list):
+        """
+        Texts are encoded in chunks of `batch_size` and scored against the
+        cached label matrix with one matmul per chunk.
+        """
+        # Dynamic int8 scales activations over the whole batch, so a text's score would depend
+        # on whichever other requests shared its batch (and be memoized that way); encode
+        # each text on its own there so results are the same for any traffic
+        chunk = 1 if self.embedder_quantized else self.batch_size
+
+        # The first chunk of texts is encoded along with any labels not cached yet
+        label_embs, first_embs = self._label_matrix(labels, texts[:chunk])
+        k = min(5, len(labels))
+        # On GPU the matmul below is already the fast path; faiss helps large label sets on CPU
+        index = None
+        if faiss is not None and self.device.type == "cpu" and len(labels) >= self.faiss_min_labels:
+            index = self._label_index(labels, label_embs)
+
+        results = []
+        for start in range(0, len(texts), chunk):
+            # ---- 1. Embed a chunk of texts in one forward pass ----
+            text_embs = first_embs if start == 0 else self._embed(texts[start:start + chunk])
+
+            if index is not None:
+                # ---- 2+3. Exact top 5 per row from the faiss index ----
+                top_scores, top_indices = index.search(np.ascontiguousarray(text_embs.cpu().numpy(), dtype=np.float32), k)
+                rows = zip(top_scores.tolist(), top_indices.tolist())
+            else:
+                # ---- 2. Cosine similarity for the whole chunk (rows are unit length) ----
+                scores = text_embs @ label_embs.T
+
+                # ---- 3. Top 5 per row, moved to CPU once ----
+                top = torch.topk(scores, k=k, dim=1)
+                rows = zip(top.values.tolist(), top.indices.tolist())
+            for row_scores, row_indices in rows:
+                results.append([
+                    {"label": labels[i], "score": float(score)}
+                    for score, i in zip(row_scores, row_indices)
+                ])
+        return results
 
     def explain_prediction(self, text: str, label: str, score: float = None):
-        if not self.generator:
+        if self.generator is None:
             raise Exception("Generator model not loaded")
 
         score_info = f" The similarity score was {score:.3f}." if score else ""
@@ -81,17 +399,91 @@ class MLEngine:
         prompt = (
         f"Explain in one concise line why the transaction '{text}' matches the category '{label}'{score_info}, without restating the transaction description."
         )
-        output = self.generator(
-            prompt,
+        result = self._generate(prompt)
+        return f"This transaction aligns with the {label} category based on its meaning, supported by a similarity score of {score:3f}."+result
+
+    @torch.inference_mode()
+    def _generate_uncached(self, prompt: str):
+        """Greedy, KV-cached completion of `prompt`; returns only the new text"""
+        enc = self.generator_tokenizer(prompt, return_tensors="pt").to(self.device)
+        output = self.generator.generate(
+            **enc,
             max_new_tokens=30,
             do_sample=False,
-            temperature=0.0,
-
+            num_beams=1,
+            use_cache=True,
+            pad_token_id=self.generator_tokenizer.eos_token_id,
         )
+        return self.generator_tokenizer.decode(output[0][enc["input_ids"].shape[1]:], skip_special_tokens=True)
+
+
+class InferenceQueue:
+    """
+    Micro-batcher for single predictions: requests that arrive within `max_latency_ms`
+    of each other (up to `max_batch`) are scored with one predict_batch call.
+    """
+    def __init__(self, engine: MLEngine, max_batch: int = 32, max_latency_ms: float = 5.0):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000
+        self.loop = None
+        self.queue = None
+        self.worker = None
+
+    def _ensure_started(self):
+        # Bound to the running loop; (re)started lazily if that loop changed
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.queue = asyncio.Queue()
+            self.worker = loop.create_task(self._run())
+
+    async def submit(self, text: str, labels: list):
+        """Queue one prediction and wait for its top results"""
+        self._ensure_started()
+        future = self.loop.create_future()
+        await self.queue.put((text, tuple(labels), future))
+        return await future
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+        self.loop = self.queue = self.worker = None
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = self.loop.time() + self.max_latency
+            while len(batch) < self.max_batch:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Only requests with the same label set can share a label matrix
+            groups = {}
+            for text, labels, future in batch:
+                groups.setdefault(labels, []).append((text, future))
 
-        result = output[0]["generated_text"]
-        le=len(prompt)
-        return f"This transaction aligns with the {label} category based on its meaning, supported by a similarity score of {score:3f}."+result[le:]
+            for labels, items in groups.items():
+                texts = [text for text, _ in items]
+                try:
+                    # Inference runs off the event loop, one batch at a time, on the engine's inference thread
+                    results = await self.loop.run_in_executor(
+                        self.engine.inference_executor, self.engine.predict_batch, texts, list(labels)
+                    )
+                except Exception as e:
+                    for _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), result in zip(items, results):
+                    if not future.done():
+                        future.set_result(result)
 
 
-ml_instance = MLEngine()
\ No newline at end of file
+ml_instance = MLEngine()
+inference_queue = InferenceQueue(ml_instance)
\ No newline at end of file
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
@@ -28,17 +28,21 @@ class PredictResponse(BaseModel):
     text: str
     top_results: List[PredictionResult]
 
-# Response for history endpoint
-class HistoryResponse(BaseModel):
+# Row of the history list (no per-row Top-K JSON; top label/score come from columns)
+class HistorySummary(BaseModel):
     id: int
     query_text: str
-    model_results: List[Dict[str, Any]]
+    top_label: Optional[str] = None
+    top_score: Optional[float] = None
     user_reported_wrong: bool
     correct_label_provided: Optional[str]
     timestamp: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+# Response for a single history record, with the full Top-K results
+class HistoryResponse(HistorySummary):
+    model_results: List[Dict[str, Any]]
 
 # --- NEW ADDITIONS ---
 class DescriptionSuggestionRequest(BaseModel):
@@ -61,8 +65,11 @@ class LabelResponse(BaseModel):
     description: Optional[str] = None
     is_active: bool
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class BootstrapResponse(BaseModel):
+    labels: List[LabelResponse]
+    history: List[HistorySummary]
 
 class BulkPredictionResult(BaseModel):
     history_id: int
@@ -71,6 +78,14 @@ class BulkPredictionResult(BaseModel):
     confidence: float
     top_results: List[PredictionResult]
 
+class BulkTextItem(BaseModel):
+    text: str
+
+# One entry of a bulk label upload (entries without a label are skipped)
+class BulkLabelItem(BaseModel):
+    label: Optional[str] = None
+    description: Optional[str] = None
+
 class BulkResponse(BaseModel):
     total_processed: int
     results: List[BulkPredictionResult]